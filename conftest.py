@@ -0,0 +1,23 @@
+import pytest
+import pytest_asyncio.plugin
+
+try:
+    import uvloop
+except ImportError:  # uvloop is optional; tests run on the default asyncio loop without it
+    uvloop = None
+
+# pytest-asyncio 1.4 added the pytest_asyncio_loop_factories hook and deprecated overriding the
+# event_loop_policy fixture; older releases (such as the pinned 1.0) only support the fixture.
+_HAS_LOOP_FACTORIES_HOOK = hasattr(
+    getattr(pytest_asyncio.plugin, "PytestAsyncioSpecs", None), "pytest_asyncio_loop_factories"
+)
+
+# Run async tests on uvloop, which starts event loops faster than the default selector loop
+# and schedules callbacks the way production servers running under uvloop do.
+if uvloop is not None and _HAS_LOOP_FACTORIES_HOOK:
+    def pytest_asyncio_loop_factories(config, item):
+        return {"uvloop": uvloop.new_event_loop}
+elif uvloop is not None:
+    @pytest.fixture(scope="session")
+    def event_loop_policy():
+        return uvloop.EventLoopPolicy()
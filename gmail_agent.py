@@ -15,22 +15,67 @@ GMAIL_FIELDS = [
     "messageText",
 ]
 
+Message details are requested through the Gmail batch endpoint (one multipart/mixed POST per
+100 messages) rather than one GET per message; if the batch request fails, the module falls back
+to concurrent per-message GETs.
+
+Calls on the same event loop share one httpx.AsyncClient (see get_client), so repeated calls reuse
+the pooled connection to gmail.googleapis.com. The client is closed when asyncio.run() shuts its loop
+down; loops managed by hand should call aclose() before closing. Labels and profile are
+cached per access token for LABELS_PROFILE_TTL_SEC seconds; the message list is always fetched fresh.
+
 Usage:
     await fetch_gmail_summary(access_token)
 
 Args:
     access_token (str): OAuth2 access token for Gmail API.
+    use_batch (bool): Fetch message details through the batch endpoint (default True).
+    include_body (bool): Fetch and extract message bodies (default True). When False, messages are
+        fetched in Gmail's much smaller metadata format and 'messageText' is None.
+    client (httpx.AsyncClient, optional): Client to use instead of the shared one.
 
 Returns:
     dict: Dictionary with 'labels', 'profile', and 'emails' (list of dicts with only the required fields).
 """
 
-from typing import List, Dict, Any
+from typing import List, AsyncGenerator, Deque, Dict, Any, Iterable, Mapping, Optional, Tuple
+from types import MappingProxyType
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from email.parser import BytesParser
+import anyio
 import httpx
 import asyncio
 import base64
-import quopri
-from bs4 import BeautifulSoup
+import hashlib
+import html
+import importlib.util
+import json
+import logging
+import re
+import threading
+import uuid
+import weakref
+from urllib.parse import urlencode
+from cachetools import TTLCache
+
+try:
+    # C (lexbor) HTML parser. BeautifulSoup (pure-Python html.parser) is only imported when it is
+    # missing, keeping bs4's sizeable import chain off the cold-start path.
+    from selectolax.lexbor import LexborHTMLParser
+    BeautifulSoup = None
+except ImportError:  # pragma: no cover - depends on the environment
+    LexborHTMLParser = None
+    from bs4 import BeautifulSoup
+
+try:
+    # orjson decodes response bytes directly; stdlib json.loads also accepts bytes.
+    from orjson import loads as _json_loads
+except ImportError:  # pragma: no cover - depends on the environment
+    _json_loads = json.loads
+
+logger = logging.getLogger(__name__)
 
 GMAIL_FIELDS = [
     "messageId",
@@ -42,132 +87,513 @@ GMAIL_FIELDS = [
     "messageText",
 ]
 
-async def fetch_gmail_summary(access_token: str) -> Dict[str, Any]:
+@dataclass(slots=True)
+class EmailSummary:
+    """
+    Essential fields of one Gmail message. as_dict() returns the GMAIL_FIELDS mapping.
+    """
+    message_id: Optional[str]
+    thread_id: Optional[str]
+    message_timestamp: Optional[int]
+    label_ids: List[str]
+    sender: Optional[str]
+    subject: Optional[str]
+    message_text: Optional[str]
+
+    def as_dict(self) -> Dict[str, Any]:
+        """Return the summary keyed by GMAIL_FIELDS, as returned by fetch_gmail_summary."""
+        return {
+            "messageId": self.message_id,
+            "threadId": self.thread_id,
+            "messageTimestamp": self.message_timestamp,
+            "labelIds": self.label_ids,
+            "sender": self.sender,
+            "subject": self.subject,
+            "messageText": self.message_text,
+        }
+
+@dataclass(slots=True)
+class EmailBatch:
+    """
+    Column-oriented view of many EmailSummary objects: one list per field, index-aligned,
+    so consumers scanning a single field don't touch the others.
+    """
+    message_ids: List[Optional[str]] = field(default_factory=list)
+    thread_ids: List[Optional[str]] = field(default_factory=list)
+    message_timestamps: List[Optional[int]] = field(default_factory=list)
+    label_ids: List[List[str]] = field(default_factory=list)
+    senders: List[Optional[str]] = field(default_factory=list)
+    subjects: List[Optional[str]] = field(default_factory=list)
+    message_texts: List[Optional[str]] = field(default_factory=list)
+
+    @classmethod
+    def from_summaries(cls, summaries: Iterable[EmailSummary]) -> "EmailBatch":
+        """Build a batch from EmailSummary objects, keeping their order."""
+        batch = cls()
+        for summary in summaries:
+            batch.append(summary)
+        return batch
+
+    def append(self, summary: EmailSummary) -> None:
+        """Add one summary to the end of every column."""
+        self.message_ids.append(summary.message_id)
+        self.thread_ids.append(summary.thread_id)
+        self.message_timestamps.append(summary.message_timestamp)
+        self.label_ids.append(summary.label_ids)
+        self.senders.append(summary.sender)
+        self.subjects.append(summary.subject)
+        self.message_texts.append(summary.message_text)
+
+    def __len__(self) -> int:
+        return len(self.message_ids)
+
+# Partial-response field masks: Gmail trims each response to these fields before sending it.
+LABELS_FIELDS = "labels(id,name)"
+MESSAGE_LIST_FIELDS = "messages/id"
+# Covers everything extract_essential_fields reads; the innermost `parts` keeps deeper MIME trees intact.
+MESSAGE_FIELDS = (
+    "id,threadId,internalDate,labelIds,"
+    "payload(mimeType,headers,body/data,parts(mimeType,body/data,parts(mimeType,body/data,parts)))"
+)
+MESSAGE_PARAMS = {"format": "full", "fields": MESSAGE_FIELDS}
+# Summary-only fetches: format=metadata skips the MIME tree and returns just the requested headers.
+METADATA_FIELDS = "id,threadId,internalDate,labelIds,payload/headers"
+METADATA_PARAMS = {"format": "metadata", "metadataHeaders": ["From", "Subject"], "fields": METADATA_FIELDS}
+# Query strings for batched message subrequests, encoded once at import time.
+_MESSAGE_QUERY = urlencode(MESSAGE_PARAMS)
+_METADATA_QUERY = urlencode(METADATA_PARAMS, doseq=True)
+
+GMAIL_API_ROOT = "https://gmail.googleapis.com"
+GMAIL_BATCH_URL = f"{GMAIL_API_ROOT}/batch/gmail/v1"
+GMAIL_MESSAGES_PATH = "/gmail/v1/users/me/messages"
+# Gmail rejects batch requests with more than 100 subrequests.
+GMAIL_BATCH_LIMIT = 100
+
+# Google only compresses responses reliably when the User-Agent contains "gzip".
+USER_AGENT = "gmail-agent/0.1.0 (gzip)"
+# httpx can only decode brotli responses when brotli (or brotlicffi) is installed.
+ACCEPT_ENCODING = (
+    "gzip, br"
+    if importlib.util.find_spec("brotli") or importlib.util.find_spec("brotlicffi")
+    else "gzip"
+)
+
+# Every call goes to gmail.googleapis.com, so requests are multiplexed as HTTP/2 streams over one
+# pooled connection; the keepalive headroom only matters if the server falls back to HTTP/1.1.
+CLIENT_LIMITS = httpx.Limits(max_keepalive_connections=8)
+
+# Shared clients, one per event loop (pooled connections can't move between loops), created lazily by
+# get_client(). Each maps loop -> (client, async generator that closes it when the loop shuts down).
+_clients: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+_clients_lock = threading.Lock()
+
+# Message extraction (base64 decoding, HTML parsing) runs on these threads so it never blocks the
+# event loop; the cap keeps concurrent callers from spawning a thread per message.
+_EXTRACT_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix="gmail-extract")
+
+# Labels and profile rarely change within a session, so they are reused for this many seconds.
+LABELS_PROFILE_TTL_SEC = 60
+# (labels, profile) keyed by a SHA-256 digest of the access token, so tokens are never kept as keys.
+# TTLCache is not thread-safe, and callers may run event loops in several threads.
+_labels_profile_cache: TTLCache = TTLCache(maxsize=128, ttl=LABELS_PROFILE_TTL_SEC)
+_labels_profile_lock = threading.Lock()
+
+# Longest stretch (seconds) the event loop is held while decoding responses before other tasks get
+# a turn; bounds tail latency for concurrent callers sharing the loop (e.g. in a web server).
+STARVATION_LIMIT_SEC = 0.02
+
+# Shared read-only default for missing payload/body objects, so lookups don't allocate a dict per miss.
+_EMPTY: Mapping[str, Any] = MappingProxyType({})
+
+# Separates the status line and headers of a batched HTTP response from its body.
+_HTTP_HEAD_END_RE = re.compile(rb"\r?\n\r?\n")
+
+async def _close_at_loop_shutdown(client: httpx.AsyncClient) -> AsyncGenerator[None, None]:
+    """
+    Suspends until the event loop finalizes its async generators (loop.shutdown_asyncgens(),
+    which asyncio.run() calls before closing the loop), then closes client.
+    """
+    try:
+        yield
+    finally:
+        await client.aclose()
+
+async def get_client() -> httpx.AsyncClient:
+    """
+    Return the running event loop's shared AsyncClient, creating it on first use.
+    The client carries no credentials; the access token is sent per request.
+    """
+    loop = asyncio.get_running_loop()
+    with _clients_lock:
+        entry = _clients.get(loop)
+    if entry is not None and not entry[0].is_closed:
+        return entry[0]
+
+    client = httpx.AsyncClient(
+        headers={"Accept-Encoding": ACCEPT_ENCODING, "User-Agent": USER_AGENT},
+        http2=True,
+        limits=CLIENT_LIMITS,
+        timeout=30.0,
+    )
+    closer = _close_at_loop_shutdown(client)
+    # Starting the generator registers it with the loop's async generator hooks.
+    await closer.__anext__()
+    with _clients_lock:
+        _clients[loop] = (client, closer)
+    if entry is not None:
+        await entry[1].aclose()
+    return client
+
+async def aclose() -> None:
+    """
+    Close the running event loop's shared AsyncClient, if one was created.
+    """
+    with _clients_lock:
+        entry = _clients.pop(asyncio.get_running_loop(), None)
+    if entry is not None:
+        await entry[1].aclose()
+
+async def fetch_gmail_summary(
+    access_token: str,
+    use_batch: bool = True,
+    client: Optional[httpx.AsyncClient] = None,
+    include_body: bool = True,
+) -> Dict[str, Any]:
     """
     Fetch user's labels, profile, and last 10 emails from Gmail API, returning only essential fields.
 
     Args:
         access_token (str): OAuth2 access token for Gmail API.
+        use_batch (bool): Fetch message details with one batch request instead of one GET per message.
+        client (httpx.AsyncClient, optional): Client to send requests with; defaults to the shared client.
+        include_body (bool): Fetch message bodies; when False only metadata is fetched and 'messageText' is None.
 
     Returns:
         dict: Dictionary with 'labels', 'profile', and 'emails' (list of dicts with only the required fields).
     """
+    if client is None:
+        client = await get_client()
     headers = {"Authorization": f"Bearer {access_token}"}
-    base_url = "https://gmail.googleapis.com/gmail/v1/users/me"
+    base_url = f"{GMAIL_API_ROOT}/gmail/v1/users/me"
+
+    cache_key = hashlib.sha256(access_token.encode()).hexdigest()
+    with _labels_profile_lock:
+        cached = _labels_profile_cache.get(cache_key)
 
-    async with httpx.AsyncClient(headers=headers, timeout=30.0) as client:
+    messages_task = client.get(
+        f"{base_url}/messages", headers=headers, params={"maxResults": 10, "fields": MESSAGE_LIST_FIELDS}
+    )
+    if cached is None:
         # Fetch labels, profile, and message list concurrently
-        labels_task = client.get(f"{base_url}/labels")
-        profile_task = client.get(f"{base_url}/profile")
-        messages_task = client.get(f"{base_url}/messages", params={"maxResults": 10, "q": ""})
+        labels_task = client.get(f"{base_url}/labels", headers=headers, params={"fields": LABELS_FIELDS})
+        profile_task = client.get(f"{base_url}/profile", headers=headers)
         labels_resp, profile_resp, messages_resp = await asyncio.gather(labels_task, profile_task, messages_task)
-        labels = labels_resp.json()
-        profile = profile_resp.json()
-        messages = messages_resp.json()
+        labels = _json_loads(labels_resp.content).get("labels", [])
+        profile = _json_loads(profile_resp.content)
+        # Only cache real answers, so an error response is not served for the next minute
+        if labels_resp.status_code == 200 and profile_resp.status_code == 200:
+            with _labels_profile_lock:
+                _labels_profile_cache[cache_key] = _copy_labels_profile(labels, profile)
+    else:
+        # Callers get their own copies, so mutating a result can't change what later calls see
+        labels, profile = _copy_labels_profile(*cached)
+        messages_resp = await messages_task
+    messages = _json_loads(messages_resp.content)
 
+    message_ids = [msg["id"] for msg in messages.get("messages", [])]
+    message_jsons: Optional[List[Dict[str, Any]]] = None
+    if use_batch and message_ids:
+        query = _MESSAGE_QUERY if include_body else _METADATA_QUERY
+        message_jsons = await _batch_get_messages(client, message_ids, headers, query)
+    if message_jsons is None:
         # Fetch each message's details concurrently
-        message_ids = [msg["id"] for msg in messages.get("messages", [])]
-        message_tasks = [client.get(f"{base_url}/messages/{msg_id}") for msg_id in message_ids]
-        message_responses = await asyncio.gather(*message_tasks)
-        message_jsons = [resp.json() for resp in message_responses]
+        params = MESSAGE_PARAMS if include_body else METADATA_PARAMS
+        message_bodies = await _get_messages(client, message_ids, headers, params)
+        message_jsons = await _decode_json_bodies(message_bodies)
 
-        emails = [extract_essential_fields(msg) for msg in message_jsons]
+    if include_body:
+        loop = asyncio.get_running_loop()
+        summaries = await asyncio.gather(*(
+            loop.run_in_executor(_EXTRACT_EXECUTOR, extract_essential_fields, msg) for msg in message_jsons
+        ))
+    else:
+        # Metadata-only extraction is a handful of lookups; a thread hop would cost more.
+        summaries = [extract_essential_fields(msg, include_body=False) for msg in message_jsons]
 
-        return {
-            "labels": labels.get("labels", []),
-            "profile": profile,
-            "emails": emails,
-        }
+    return {
+        "labels": labels,
+        "profile": profile,
+        "emails": [summary.as_dict() for summary in summaries],
+    }
 
-def extract_essential_fields(message: Dict[str, Any]) -> Dict[str, Any]:
+def _copy_labels_profile(
+    labels: List[Dict[str, Any]], profile: Dict[str, Any]
+) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """
+    Copy the labels list, each label, and the profile. All of them are flat JSON objects
+    (labels are masked to id and name), so a one-level copy shares nothing mutable.
+    """
+    return [dict(label) for label in labels], dict(profile)
+
+async def _get_messages(
+    client: httpx.AsyncClient, message_ids: List[str], headers: Dict[str, str], params: Dict[str, Any]
+) -> List[bytes]:
+    """
+    Fetch message resources with one GET per id, run concurrently in an anyio task group.
+    Returns the raw bodies in message_ids order; failed requests are logged and skipped
+    rather than discarding the ones that succeeded.
+    """
+    messages_url = f"{GMAIL_API_ROOT}{GMAIL_MESSAGES_PATH}"
+    responses: List[Any] = [None] * len(message_ids)
+
+    async def fetch(index: int, msg_id: str) -> None:
+        # Store the failure instead of raising, which would cancel the sibling requests
+        try:
+            responses[index] = await client.get(f"{messages_url}/{msg_id}", headers=headers, params=params)
+        except Exception as exc:
+            responses[index] = exc
+
+    async with anyio.create_task_group() as task_group:
+        for index, msg_id in enumerate(message_ids):
+            task_group.start_soon(fetch, index, msg_id)
+
+    message_bodies = []
+    for msg_id, resp in zip(message_ids, responses):
+        if isinstance(resp, Exception):
+            logger.warning("Fetching message %s failed: %r", msg_id, resp)
+        elif not 200 <= resp.status_code < 300:
+            logger.warning("Fetching message %s returned HTTP %s", msg_id, resp.status_code)
+        else:
+            message_bodies.append(resp.content)
+    return message_bodies
+
+async def _decode_json_bodies(bodies: Iterable[bytes]) -> List[Any]:
+    """
+    Decode JSON response bodies on the event loop, yielding to other tasks whenever decoding
+    has held the loop for STARVATION_LIMIT_SEC. Empty bodies decode to {}.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + STARVATION_LIMIT_SEC
+    decoded = []
+    for body in bodies:
+        decoded.append(_json_loads(body) if body.strip() else {})
+        if loop.time() >= deadline:
+            await asyncio.sleep(0)
+            deadline = loop.time() + STARVATION_LIMIT_SEC
+    return decoded
+
+def _build_batch_body(message_ids: List[str], boundary: str, query: str = _MESSAGE_QUERY) -> bytes:
+    """
+    Build a multipart/mixed batch body with one GET subrequest per message id, each carrying
+    the given query string (by default the full format with the MESSAGE_FIELDS mask).
+    The Content-ID of each subrequest is its index in message_ids.
+    """
+    parts = [
+        f"--{boundary}\r\n"
+        "Content-Type: application/http\r\n"
+        f"Content-ID: <{index}>\r\n"
+        "\r\n"
+        f"GET {GMAIL_MESSAGES_PATH}/{msg_id}?{query}\r\n"
+        "\r\n"
+        for index, msg_id in enumerate(message_ids)
+    ]
+    parts.append(f"--{boundary}--\r\n")
+    return "".join(parts).encode("ascii")
+
+def _parse_batch_response(content_type: str, content: bytes) -> List[Tuple[int, int, bytes]]:
+    """
+    Split a multipart/mixed batch response into (subrequest index, HTTP status, raw body)
+    for each subresponse, ordered by the Content-ID of the originating subrequest.
+    """
+    envelope = BytesParser().parsebytes(b"Content-Type: " + content_type.encode("latin-1") + b"\r\n\r\n" + content)
+    if not envelope.is_multipart():
+        raise ValueError("Batch response is not multipart")
+
+    indexed_bodies = []
+    for position, part in enumerate(envelope.get_payload()):
+        # Gmail answers Content-ID <n> with Content-ID <response-n>.
+        content_id = (part.get("Content-ID") or "").strip("<> ").rpartition("-")[2]
+        index = int(content_id) if content_id.isdigit() else position
+        http_response = part.get_payload(decode=True) or b""
+        # Status line, e.g. b"HTTP/1.1 404 Not Found"; anything unreadable counts as a failure.
+        status_fields = http_response.split(b"\n", 1)[0].split()
+        status = int(status_fields[1]) if len(status_fields) > 1 and status_fields[1].isdigit() else 0
+        head_end = _HTTP_HEAD_END_RE.search(http_response)
+        body = http_response[head_end.end():] if head_end else b""
+        indexed_bodies.append((index, status, body))
+
+    indexed_bodies.sort(key=lambda item: item[0])
+    return indexed_bodies
+
+async def _batch_get_messages(
+    client: httpx.AsyncClient, message_ids: List[str], headers: Dict[str, str], query: str = _MESSAGE_QUERY
+) -> Optional[List[Dict[str, Any]]]:
+    """
+    Fetch message resources through the Gmail batch endpoint, GMAIL_BATCH_LIMIT ids per request.
+    Subrequests that fail are logged and skipped. Returns None if a whole batch request fails,
+    is rejected or is unreadable, so the caller can fall back to per-message GETs.
+    """
+    chunks = [message_ids[i:i + GMAIL_BATCH_LIMIT] for i in range(0, len(message_ids), GMAIL_BATCH_LIMIT)]
+    boundaries = [f"batch_{uuid.uuid4().hex}" for _ in chunks]
+    try:
+        batch_responses = await asyncio.gather(*(
+            client.post(
+                GMAIL_BATCH_URL,
+                headers={**headers, "Content-Type": f"multipart/mixed; boundary={boundary}"},
+                content=_build_batch_body(chunk, boundary, query),
+            )
+            for chunk, boundary in zip(chunks, boundaries)
+        ))
+    except httpx.HTTPError as exc:  # e.g. a timeout on a large batch
+        logger.warning("Batch request failed, falling back to per-message requests: %r", exc)
+        return None
+
+    bodies: List[bytes] = []
+    for chunk, resp in zip(chunks, batch_responses):
+        if resp.status_code != 200:
+            return None
+        try:
+            subresponses = _parse_batch_response(resp.headers.get("Content-Type", ""), resp.content)
+        except ValueError:
+            return None
+        for index, status, body in subresponses:
+            if 200 <= status < 300:
+                bodies.append(body)
+            else:
+                msg_id = chunk[index] if index < len(chunk) else f"#{index}"
+                logger.warning("Fetching message %s returned HTTP %s", msg_id, status)
+    try:
+        return await _decode_json_bodies(bodies)
+    except ValueError:
+        return None
+
+def extract_essential_fields(message: Dict[str, Any], include_body: bool = True) -> EmailSummary:
     """
     Extract only the essential fields from a Gmail message resource.
+    With include_body=False the body is not read and message_text is None.
     """
-    payload = message.get("payload", {})
-    headers = {h["name"]: h["value"] for h in payload.get("headers", [])}
-    message_text = extract_message_text(payload)
-    return {
-        "messageId": message.get("id"),
-        "threadId": message.get("threadId"),
-        "messageTimestamp": int(message.get("internalDate", 0)) // 1000 if message.get("internalDate") else None,
-        "labelIds": message.get("labelIds", []),
-        "sender": headers.get("From"),
-        "subject": headers.get("Subject"),
-        "messageText": message_text,
-    }
+    payload = message.get("payload", _EMPTY)
+
+    # Only From and Subject are used, so scan the headers without building a dict
+    # and stop as soon as both have been seen. The first occurrence of each wins.
+    sender = subject = None
+    for header in payload.get("headers", ()):
+        name = header.get("name")
+        if name == "From" and sender is None:
+            sender = header.get("value")
+        elif name == "Subject" and subject is None:
+            subject = header.get("value")
+        if sender is not None and subject is not None:
+            break
+
+    internal_date = message.get("internalDate")
+    return EmailSummary(
+        message_id=message.get("id"),
+        thread_id=message.get("threadId"),
+        message_timestamp=int(internal_date) // 1000 if internal_date else None,
+        label_ids=message.get("labelIds", []),
+        sender=sender,
+        subject=subject,
+        message_text=extract_message_text(payload) if include_body else None,
+    )
+
+# Padding that completes a base64 string, indexed by its length % 4. A remainder of 1 can never be
+# valid base64, so its entry just lets urlsafe_b64decode reject it.
+_B64_PAD = ("", "===", "==", "=")
 
 # Helper function for decoding email body data
 def _decode_part_data(data_string: str) -> str:
-    """Decodes base64url encoded string, with fallback for quopri and utf-8 errors."""
+    """Decodes base64url encoded string as UTF-8, replacing bytes that are not valid UTF-8."""
     if not data_string:
         return ""
-    
-    # Add correct padding for base64url
-    padding = '=' * (-len(data_string) % 4)
-    try:
-        decoded_bytes = base64.urlsafe_b64decode(data_string + padding)
-    except Exception: # Catch base64 decoding errors
-        # If base64 decoding itself fails, return empty or log an error
-        return ""
 
     try:
-        # Try decoding as UTF-8 first
-        return decoded_bytes.decode('utf-8')
-    except UnicodeDecodeError:
-        # If UTF-8 fails, try quoted-printable, then decode its result as UTF-8
-        try:
-            # quopri.decodestring expects bytes
-            quopri_decoded_bytes = quopri.decodestring(decoded_bytes)
-            return quopri_decoded_bytes.decode('utf-8', errors='replace')
-        except Exception:
-            # If quopri or its subsequent decode fails, fallback to decoding original bytes with 'replace'
-            return decoded_bytes.decode('utf-8', errors='replace')
-    except Exception:
-        # Catch any other unforeseen errors during decoding attempts
+        decoded_bytes = base64.urlsafe_b64decode(data_string + _B64_PAD[len(data_string) & 3])
+    except ValueError:  # binascii.Error, or non-ASCII input
         return ""
+    # Gmail has already undone any Content-Transfer-Encoding (e.g. quoted-printable) before
+    # base64url-encoding body.data, so the bytes only need a charset decode.
+    return decoded_bytes.decode('utf-8', errors='replace')
+
+# Fast path for small, simple HTML: drop the tags with a regex instead of building a DOM.
+# Quoted attribute values may contain '>', so they are matched as a unit.
+_TAG_RE = re.compile(r"""<(?:"[^"]*"|'[^']*'|[^'">])*>""")
+# A '<' that can't start a tag (e.g. "5 < 10") is text the tag regex would swallow.
+_BARE_LT_RE = re.compile(r"<(?![A-Za-z/!])")
+# Markup the regex can't strip correctly: script/style/head/title content is not body text and
+# comments (including Outlook conditional comments) may contain '>' or duplicate markup.
+_FULL_PARSE_MARKERS = ("<script", "<style", "<head", "<title", "<!--")
+FAST_HTML_MAX_LEN = 16384
+
+def _html_to_text(decoded_html: str) -> str:
+    """Converts an HTML body to newline-separated text, skipping <script> and <style> content."""
+    if len(decoded_html) < FAST_HTML_MAX_LEN:
+        lowered = decoded_html.lower()
+        if not any(marker in lowered for marker in _FULL_PARSE_MARKERS) and not _BARE_LT_RE.search(decoded_html):
+            stripped = _TAG_RE.sub("\n", decoded_html)
+            # Any '<' left over is a tag the regex couldn't close (e.g. an unbalanced quote).
+            if "<" not in stripped:
+                lines = html.unescape(stripped).splitlines()
+                return "\n".join(line for line in map(str.strip, lines) if line)
+    return _parse_html_to_text(decoded_html)
+
+def _parse_html_to_text(decoded_html: str) -> str:
+    """Converts an HTML body to text with a full HTML parser (selectolax, else BeautifulSoup)."""
+    if LexborHTMLParser is not None:
+        tree = LexborHTMLParser(decoded_html)
+        tree.strip_tags(["script", "style"])
+        return tree.body.text(separator="\n", strip=True) if tree.body else ""
+    soup = BeautifulSoup(decoded_html, "html.parser")
+    return soup.get_text(separator="\n", strip=True)
 
 def extract_message_text(payload: Dict[str, Any]) -> str:
     """
     Extracts and concatenates all plain text content from the message payload parts.
-    Prioritizes text/plain and text/html parts using a depth-first traversal.
+    Parts are read in document order using a depth-first traversal. text/html parts are only
+    decoded and converted when the message has no text/plain part, as mail clients pick one
+    alternative rather than showing both.
     """
-    collected_texts: List[str] = []
-    parts_to_visit: List[Dict[str, Any]] = [payload]  # Start with the main payload
+    # (is_html, value) in document order; HTML parts keep their raw body data until we know
+    # whether they are needed.
+    collected: List[Tuple[bool, str]] = []
+    has_plain_text = False
+    parts_to_visit: Deque[Dict[str, Any]] = deque([payload])  # Start with the main payload
 
     while parts_to_visit:
-        current_part = parts_to_visit.pop() # Depth-First Search
-        
+        current_part = parts_to_visit.popleft()  # Depth-First Search in document order
+
         mime_type = current_part.get("mimeType", "").lower()
-        body_data = current_part.get("body", {}).get("data")
+        body_data = current_part.get("body", _EMPTY).get("data")
         sub_parts = current_part.get("parts")
 
         if body_data:
-            if mime_type == "text/plain":
+            if mime_type == "text/html":
+                collected.append((True, body_data))
+            # text/plain parts are always read; any other part only if it is a leaf
+            # (not a multipart container and no sub_parts).
+            elif mime_type == "text/plain" or not (sub_parts or mime_type.startswith("multipart/")):
                 decoded_text = _decode_part_data(body_data)
                 if decoded_text:
-                    collected_texts.append(decoded_text)
-            elif mime_type == "text/html":
-                decoded_html = _decode_part_data(body_data)
-                if decoded_html:
-                    soup = BeautifulSoup(decoded_html, "html.parser")
-                    extracted_text = soup.get_text(separator="\\n", strip=True)
-                    if extracted_text:
-                        collected_texts.append(extracted_text)
-            # Fallback for body_data if not already processed as text/plain or text/html,
-            # and it's not a multipart container itself and has no sub_parts (indicating it's a leaf with data).
-            elif not sub_parts and not mime_type.startswith("multipart/"):
-                decoded_text = _decode_part_data(body_data)
-                if decoded_text:
-                    collected_texts.append(decoded_text)
-        
+                    collected.append((False, decoded_text))
+                    # A blank text/plain alternative (common next to marketing HTML) doesn't replace the HTML.
+                    if mime_type == "text/plain" and decoded_text.strip():
+                        has_plain_text = True
+
         # If there are sub-parts, add them for processing.
         # This ensures that parts of a message are processed even if the parent part 
         # doesn't have a 'multipart/*' mimeType but does contain a 'parts' array.
         if sub_parts:
-            # Add them in reversed order so that pop() processes them in their original order (maintaining DFS behavior).
-            for sub_part in reversed(sub_parts):
-                parts_to_visit.append(sub_part)
-                
-    # The order of collected_texts might be reversed from the visual order in complex emails
-    # depending on DFS traversal. Reversing here attempts to restore a more natural top-to-bottom flow.
-    return "\\n".join(reversed(collected_texts)).strip() 
\ No newline at end of file
+            # extendleft() inserts one at a time, so feed it the parts reversed to keep them in their
+            # original order at the front of the queue; texts are then collected top to bottom.
+            parts_to_visit.extendleft(reversed(sub_parts))
+
+    collected_texts: List[str] = []
+    for is_html, value in collected:
+        if is_html:
+            if has_plain_text:
+                continue
+            value = _decode_part_data(value)
+            value = _html_to_text(value) if value else ""
+        if value:
+            collected_texts.append(value)
+    return "\n".join(collected_texts).strip()
@@ -1,10 +1,60 @@
 import pytest
 import asyncio
+import json
+import base64
+import gc
+import re
+import threading
+import warnings
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from typing import Dict, Any, List
 from unittest.mock import patch, AsyncMock
-from gmail_agent import fetch_gmail_summary, GMAIL_FIELDS, httpx
+import gmail_agent
+from gmail_agent import fetch_gmail_summary, extract_essential_fields, EmailBatch, extract_message_text, _decode_part_data, _decode_json_bodies, get_client, aclose, GMAIL_FIELDS, MESSAGE_FIELDS, httpx
+
+@pytest.fixture(autouse=True)
+def clear_labels_profile_cache():
+    """
+    Start every test without cached labels/profile, since tests reuse the same dummy token.
+    """
+    gmail_agent._labels_profile_cache.clear()
+    yield
+    gmail_agent._labels_profile_cache.clear()
+
+def make_batch_post(message_details: Dict[str, Dict[str, Any]], status_code: int = 200):
+    """
+    Build a side effect for httpx.AsyncClient.post that answers Gmail batch requests
+    with a multipart/mixed response built from message_details (keyed by message id).
+    Ids missing from message_details get a 404 subresponse.
+    """
+    async def mock_post_func(client_instance_self, url_passed, *args, content=b"", **kwargs):
+        if status_code != 200:
+            return httpx.Response(status_code, json={"error": {"code": status_code}})
+        requested = re.findall(rb"Content-ID: <(\d+)>\r\n\r\nGET \S+/messages/([^\s?]+)", content)
+        parts = []
+        # Answer in reverse order: Gmail does not guarantee subresponse order.
+        for content_id, msg_id in reversed(requested):
+            detail = message_details.get(msg_id.decode())
+            status_line = "HTTP/1.1 200 OK" if detail is not None else "HTTP/1.1 404 Not Found"
+            body = json.dumps(detail if detail is not None else {"error": {"code": 404}})
+            parts.append(
+                "--batch_resp\r\n"
+                "Content-Type: application/http\r\n"
+                f"Content-ID: <response-{content_id.decode()}>\r\n"
+                "\r\n"
+                f"{status_line}\r\n"
+                "Content-Type: application/json; charset=UTF-8\r\n"
+                "\r\n"
+                f"{body}\r\n"
+            )
+        parts.append("--batch_resp--\r\n")
+        return httpx.Response(
+            200,
+            headers={"Content-Type": "multipart/mixed; boundary=batch_resp"},
+            content="".join(parts).encode(),
+        )
+    return mock_post_func
 
-@pytest.mark.asyncio
 async def test_fetch_gmail_summary_normal():
     """
     Test fetch_gmail_summary with all fields present in the payload.
@@ -46,6 +96,9 @@ async def test_fetch_gmail_summary_normal():
             def json(self):
                 return self._data
             @property
+            def content(self):
+                return json.dumps(self._data).encode()
+            @property
             def status_code(self):
                 return 200
 
@@ -65,10 +118,15 @@ async def test_fetch_gmail_summary_normal():
         else:
             return MockResp({})
 
-    with patch.object(httpx.AsyncClient, 'get', autospec=True) as mock_get_call:
+    with patch.object(httpx.AsyncClient, 'get', autospec=True) as mock_get_call, \
+            patch.object(httpx.AsyncClient, 'post', autospec=True) as mock_post_call:
         mock_get_call.side_effect = mock_side_effect_func
-        
+        mock_post_call.side_effect = make_batch_post({"msg1": message_detail_1, "msg2": message_detail_2})
+
         result = await fetch_gmail_summary('dummy_token')
+        # labels, profile and the message list; details come from one batch request
+        assert mock_get_call.call_count == 3
+        assert mock_post_call.call_count == 1
         assert 'labels' in result
         assert 'profile' in result
         assert 'emails' in result
@@ -79,7 +137,6 @@ async def test_fetch_gmail_summary_normal():
         assert result['emails'][0]['messageText'] == 'Hello world!'
         assert result['emails'][1]['messageText'] == 'Test body'
 
-@pytest.mark.asyncio
 async def test_fetch_gmail_summary_missing_fields():
     """
     Test fetch_gmail_summary with some optional fields missing in the payload.
@@ -109,6 +166,9 @@ async def test_fetch_gmail_summary_missing_fields():
             def json(self):
                 return self._data
             @property
+            def content(self):
+                return json.dumps(self._data).encode()
+            @property
             def status_code(self):
                 return 200
         
@@ -126,8 +186,10 @@ async def test_fetch_gmail_summary_missing_fields():
         else:
             return MockResp({})
 
-    with patch.object(httpx.AsyncClient, 'get', autospec=True) as mock_get_call:
+    with patch.object(httpx.AsyncClient, 'get', autospec=True) as mock_get_call, \
+            patch.object(httpx.AsyncClient, 'post', autospec=True) as mock_post_call:
         mock_get_call.side_effect = mock_side_effect_func
+        mock_post_call.side_effect = make_batch_post({"msg1": message_detail_1})
 
         result = await fetch_gmail_summary('dummy_token')
         assert 'labels' in result
@@ -141,4 +203,415 @@ async def test_fetch_gmail_summary_missing_fields():
         assert email['labelIds'] == []
         assert email['sender'] is None
         assert email['subject'] == 'No Sender'
-        assert email['messageText'] == 'Without body' 
\ No newline at end of file
+        assert email['messageText'] == 'Without body' 
+
+async def test_fetch_gmail_summary_batch_fallback():
+    """
+    Test fetch_gmail_summary falls back to per-message GETs when the batch request is rejected.
+    """
+    messages_data = {"messages": [{"id": "msg1"}]}
+    message_detail_1 = {
+        "id": "msg1",
+        "payload": {
+            "headers": [{"name": "Subject", "value": "Fallback"}],
+            "body": {"data": "SGVsbG8gd29ybGQh"}  # "Hello world!"
+        }
+    }
+
+    async def mock_side_effect_func(client_instance_self, url_passed, *args, **kwargs):
+        class MockResp:
+            def __init__(self, data):
+                self._data = data
+            def json(self):
+                return self._data
+            @property
+            def content(self):
+                return json.dumps(self._data).encode()
+            @property
+            def status_code(self):
+                return 200
+
+        if url_passed.endswith('/messages'):
+            return MockResp(messages_data)
+        elif url_passed.endswith('/messages/msg1'):
+            return MockResp(message_detail_1)
+        else:
+            return MockResp({})
+
+    with patch.object(httpx.AsyncClient, 'get', autospec=True) as mock_get_call, \
+            patch.object(httpx.AsyncClient, 'post', autospec=True) as mock_post_call:
+        mock_get_call.side_effect = mock_side_effect_func
+        mock_post_call.side_effect = make_batch_post({}, status_code=500)
+
+        result = await fetch_gmail_summary('dummy_token')
+        assert mock_post_call.call_count == 1
+        assert mock_get_call.call_args.kwargs['params']['fields'] == MESSAGE_FIELDS
+        assert len(result['emails']) == 1
+        assert result['emails'][0]['subject'] == 'Fallback'
+        assert result['emails'][0]['messageText'] == 'Hello world!'
+
+async def test_fetch_gmail_summary_batch_transport_error_fallback():
+    """
+    Test fetch_gmail_summary falls back to per-message GETs when the batch request itself fails.
+    """
+    messages_data = {"messages": [{"id": "msg1"}]}
+    message_detail_1 = {"id": "msg1", "payload": {"body": {"data": "SGVsbG8gd29ybGQh"}}}
+
+    async def mock_side_effect_func(client_instance_self, url_passed, *args, **kwargs):
+        if url_passed.endswith('/messages'):
+            return httpx.Response(200, json=messages_data)
+        return httpx.Response(200, json=message_detail_1)
+
+    with patch.object(httpx.AsyncClient, 'get', autospec=True) as mock_get_call, \
+            patch.object(httpx.AsyncClient, 'post', autospec=True) as mock_post_call:
+        mock_get_call.side_effect = mock_side_effect_func
+        mock_post_call.side_effect = httpx.ReadTimeout("batch timed out")
+
+        result = await fetch_gmail_summary('dummy_token')
+        assert mock_post_call.call_count == 1
+        assert [email['messageText'] for email in result['emails']] == ['Hello world!']
+
+@pytest.mark.parametrize("use_batch", [True, False])
+async def test_fetch_gmail_summary_skips_failed_messages(use_batch):
+    """
+    Test a message that fails to load is skipped while the others are still returned.
+    """
+    messages_data = {"messages": [{"id": "msg1"}, {"id": "gone"}, {"id": "msg2"}]}
+    message_details = {
+        "msg1": {"id": "msg1", "payload": {"body": {"data": "SGVsbG8gd29ybGQh"}}},
+        "msg2": {"id": "msg2", "payload": {"body": {"data": "VGVzdCBib2R5"}}},
+    }
+
+    async def mock_side_effect_func(client_instance_self, url_passed, *args, **kwargs):
+        if url_passed.endswith('/messages'):
+            return httpx.Response(200, json=messages_data)
+        if url_passed.endswith('/messages/gone'):
+            raise httpx.ConnectError("connection reset")
+        msg_id = url_passed.rpartition('/')[2]
+        return httpx.Response(200, json=message_details.get(msg_id, {}))
+
+    with patch.object(httpx.AsyncClient, 'get', autospec=True) as mock_get_call, \
+            patch.object(httpx.AsyncClient, 'post', autospec=True) as mock_post_call:
+        mock_get_call.side_effect = mock_side_effect_func
+        mock_post_call.side_effect = make_batch_post(message_details)
+
+        result = await fetch_gmail_summary('dummy_token', use_batch=use_batch)
+        assert [email['messageId'] for email in result['emails']] == ['msg1', 'msg2']
+        assert [email['messageText'] for email in result['emails']] == ['Hello world!', 'Test body']
+
+async def test_fetch_gmail_summary_without_body():
+    """
+    Test include_body=False fetches metadata only and leaves messageText empty.
+    """
+    messages_data = {"messages": [{"id": "msg1"}]}
+    message_detail_1 = {
+        "id": "msg1",
+        "threadId": "th1",
+        "payload": {
+            "headers": [
+                {"name": "From", "value": "sender1@example.com"},
+                {"name": "Subject", "value": "Metadata only"}
+            ]
+        }
+    }
+
+    async def mock_side_effect_func(client_instance_self, url_passed, *args, **kwargs):
+        return httpx.Response(200, json=messages_data if url_passed.endswith('/messages') else {})
+
+    with patch.object(httpx.AsyncClient, 'get', autospec=True) as mock_get_call, \
+            patch.object(httpx.AsyncClient, 'post', autospec=True) as mock_post_call:
+        mock_get_call.side_effect = mock_side_effect_func
+        mock_post_call.side_effect = make_batch_post({"msg1": message_detail_1})
+
+        result = await fetch_gmail_summary('dummy_token', include_body=False)
+        batch_body = mock_post_call.call_args.kwargs['content']
+        assert b"format=metadata&metadataHeaders=From&metadataHeaders=Subject" in batch_body
+        assert b"format=full" not in batch_body
+        email = result['emails'][0]
+        assert email['sender'] == 'sender1@example.com'
+        assert email['subject'] == 'Metadata only'
+        assert email['messageText'] is None
+
+async def test_labels_and_profile_cached_per_token():
+    """
+    Test labels and profile are fetched once per token while the message list is always refetched.
+    """
+    async def mock_side_effect_func(client_instance_self, url_passed, *args, **kwargs):
+        if url_passed.endswith('/labels'):
+            return httpx.Response(200, json={"labels": [{"id": "INBOX", "name": "INBOX"}]})
+        if url_passed.endswith('/profile'):
+            return httpx.Response(200, json={"emailAddress": "user@example.com"})
+        return httpx.Response(200, json={})
+
+    with patch.object(httpx.AsyncClient, 'get', autospec=True) as mock_get_call:
+        mock_get_call.side_effect = mock_side_effect_func
+
+        first = await fetch_gmail_summary('token_a')
+        second = await fetch_gmail_summary('token_a')
+        await fetch_gmail_summary('token_b')
+
+        urls = [call.args[1].rpartition('/')[2] for call in mock_get_call.call_args_list]
+        assert urls.count('labels') == 2
+        assert urls.count('profile') == 2
+        assert urls.count('messages') == 3
+        assert second['labels'] == first['labels'] == [{"id": "INBOX", "name": "INBOX"}]
+        assert second['profile'] == {"emailAddress": "user@example.com"}
+
+        # Results are copies: mutating one must not leak into later cache hits
+        second['labels'][0]['name'] = 'changed'
+        second['labels'].append({"id": "EXTRA"})
+        second['profile']['emailAddress'] = 'changed@example.com'
+        first['labels'].clear()
+        third = await fetch_gmail_summary('token_a')
+        assert third['labels'] == [{"id": "INBOX", "name": "INBOX"}]
+        assert third['profile'] == {"emailAddress": "user@example.com"}
+
+async def test_shared_client_reused_across_calls():
+    """
+    Test that calls share one client and send the access token per request, not on the client.
+    """
+    async def mock_side_effect_func(client_instance_self, url_passed, *args, **kwargs):
+        return httpx.Response(200, json={})
+
+    with patch.object(httpx.AsyncClient, 'get', autospec=True) as mock_get_call:
+        mock_get_call.side_effect = mock_side_effect_func
+
+        await fetch_gmail_summary('token_a')
+        await fetch_gmail_summary('token_b')
+        clients = {call.args[0] for call in mock_get_call.call_args_list}
+        assert clients == {await get_client()}
+        assert 'Authorization' not in (await get_client()).headers
+        tokens = {call.kwargs['headers']['Authorization'] for call in mock_get_call.call_args_list}
+        assert tokens == {'Bearer token_a', 'Bearer token_b'}
+
+    client = await get_client()
+    await aclose()
+    assert client.is_closed
+    assert await get_client() is not client
+    await aclose()
+
+def test_shared_client_closed_when_loop_shuts_down():
+    """
+    Test each asyncio.run() gets its own shared client and closes it, leaving no transport open.
+    """
+    class EmptyJSONHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive, so an unclosed client would hold its socket
+
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header("Content-Length", "2")
+            self.end_headers()
+            self.wfile.write(b"{}")
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), EmptyJSONHandler)
+    threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/"
+
+    async def use_shared_client():
+        client = await get_client()
+        await client.get(url)
+        return client
+
+    try:
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always")
+            clients = [asyncio.run(use_shared_client()) for _ in range(2)]
+            gc.collect()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert clients[0] is not clients[1]
+    assert all(client.is_closed for client in clients)
+    leaked = [
+        str(w.message) for w in caught
+        if issubclass(w.category, ResourceWarning) and ("transport" in str(w.message) or "socket" in str(w.message))
+    ]
+    assert not leaked
+
+@pytest.mark.parametrize("use_selectolax", [True, False])
+def test_extract_message_text_html(use_selectolax):
+    """
+    Test HTML parts are converted to text with both the selectolax and BeautifulSoup parsers.
+    """
+    html = "<html><head><style>p {color: red}</style></head><body><p>Hello &amp; welcome</p>" \
+           "<script>track()</script><div>Second line</div></body></html>"
+    payload = {
+        "mimeType": "text/html",
+        "body": {"data": base64.urlsafe_b64encode(html.encode()).decode().rstrip("=")},
+    }
+    if use_selectolax:
+        if gmail_agent.LexborHTMLParser is None:
+            pytest.skip("selectolax is not installed")
+        parsers = {"LexborHTMLParser": gmail_agent.LexborHTMLParser}
+    else:
+        parsers = {"LexborHTMLParser": None, "BeautifulSoup": pytest.importorskip("bs4").BeautifulSoup}
+    with patch.multiple(gmail_agent, **parsers):
+        assert extract_message_text(payload) == "Hello & welcome\nSecond line"
+
+@pytest.mark.parametrize("html, expected", [
+    ('<p><a title="a>b" href="x">Link</a></p>', "Link"),
+    ("<p><a title='1 > 0'>Quoted</a> text</p>", "Quoted\ntext"),
+])
+def test_html_fast_path_quoted_attributes(html, expected):
+    """
+    Test the regex fast path treats '>' inside quoted attribute values as part of the tag.
+    """
+    with patch.object(gmail_agent, '_parse_html_to_text', side_effect=AssertionError("full parser used")):
+        assert gmail_agent._html_to_text(html) == expected
+
+@pytest.mark.parametrize("html", [
+    "<p>Price: 5 < 10 and 10 > 5</p><p>Next</p>",  # bare '<' would be read as a tag
+    "<title>Promo</title><p>Body</p>",  # title text is not body text
+    '<p><a title="unbalanced>Link</a></p>',  # tag the regex can't close
+])
+def test_html_fast_path_defers_to_full_parser(html):
+    """
+    Test HTML the regex fast path would corrupt is handed to the full parser instead.
+    """
+    full_parser = gmail_agent._parse_html_to_text
+    with patch.object(gmail_agent, '_parse_html_to_text', wraps=full_parser) as mock_parser:
+        assert gmail_agent._html_to_text(html) == full_parser(html)
+        mock_parser.assert_called_once_with(html)
+
+def test_html_bare_less_than_kept():
+    """
+    Test text containing a bare '<' survives HTML-to-text conversion.
+    """
+    assert gmail_agent._html_to_text("<p>Price: 5 < 10 and 10 > 5</p><p>Next</p>") == "Price: 5 < 10 and 10 > 5\nNext"
+
+def test_extract_essential_fields_header_scan():
+    """
+    Test sender and subject come from the first From/Subject headers among many others.
+    """
+    headers = [{"name": f"X-Header-{i}", "value": str(i)} for i in range(40)]
+    headers[3:3] = [{"name": "Subject", "value": "First subject"}]
+    headers[6:6] = [{"name": "Subject", "value": "Earlier duplicate subject"}]
+    headers[10:10] = [{"name": "From", "value": "sender@example.com"}]
+    headers.append({"name": "Subject", "value": "Duplicate subject"})
+    headers.append({"value": "no name"})
+    message = {"id": "msg1", "payload": {"headers": headers}}
+
+    email = extract_essential_fields(message)
+    assert email.sender == 'sender@example.com'
+    assert email.subject == 'First subject'
+
+def test_email_summary_and_batch():
+    """
+    Test EmailSummary serializes to GMAIL_FIELDS and EmailBatch keeps index-aligned columns.
+    """
+    messages = [
+        {"id": "msg1", "threadId": "th1", "internalDate": "1680000000000", "labelIds": ["INBOX"],
+         "payload": {"headers": [{"name": "From", "value": "a@example.com"}], "body": {"data": "SGk"}}},
+        {"id": "msg2", "payload": {"headers": [{"name": "Subject", "value": "Second"}]}},
+    ]
+    summaries = [extract_essential_fields(message) for message in messages]
+    assert list(summaries[0].as_dict()) == GMAIL_FIELDS
+    assert summaries[0].as_dict()['messageTimestamp'] == 1680000000
+    assert not hasattr(summaries[0], '__dict__')
+
+    batch = EmailBatch.from_summaries(summaries)
+    assert len(batch) == 2
+    assert batch.message_ids == ['msg1', 'msg2']
+    assert batch.senders == ['a@example.com', None]
+    assert batch.subjects == [None, 'Second']
+    assert batch.message_texts == ['Hi', '']
+
+def test_extract_message_text_simple_html_fast_path():
+    """
+    Test small HTML without script/style is stripped without invoking the full HTML parser.
+    """
+    html = "<div><p>Fish &amp; chips</p>\n  <p>Today <b>only</b></p></div>"
+    payload = {
+        "mimeType": "text/html",
+        "body": {"data": base64.urlsafe_b64encode(html.encode()).decode()},
+    }
+    with patch.object(gmail_agent, '_parse_html_to_text', side_effect=AssertionError("full parser used")):
+        assert extract_message_text(payload) == "Fish & chips\nToday\nonly"
+
+def test_extract_message_text_prefers_plain_alternative():
+    """
+    Test the text/plain alternative is used and the text/html alternative is never parsed.
+    """
+    def encode(text):
+        return base64.urlsafe_b64encode(text.encode()).decode()
+
+    payload = {
+        "mimeType": "multipart/alternative",
+        "parts": [
+            {"mimeType": "text/plain", "body": {"data": encode("Plain version")}},
+            {"mimeType": "text/html", "body": {"data": encode("<p>HTML version</p>")}},
+        ],
+    }
+    with patch.object(gmail_agent, '_html_to_text', side_effect=AssertionError("HTML parsed")):
+        assert extract_message_text(payload) == "Plain version"
+
+def test_extract_message_text_ignores_blank_plain_alternative():
+    """
+    Test a whitespace-only text/plain alternative doesn't hide the text/html alternative.
+    """
+    def encode(text):
+        return base64.urlsafe_b64encode(text.encode()).decode()
+
+    payload = {
+        "mimeType": "multipart/alternative",
+        "parts": [
+            {"mimeType": "text/plain", "body": {"data": encode("\r\n")}},
+            {"mimeType": "text/html", "body": {"data": encode("<p>Real content</p>")}},
+        ],
+    }
+    assert extract_message_text(payload) == "Real content"
+
+@pytest.mark.parametrize("data, expected", [
+    ("SGk", "Hi"),            # len % 4 == 3
+    ("SGk_", "Hi?"),          # url-safe alphabet
+    ("SGVsbG8", "Hello"),     # len % 4 == 3, multi-quantum
+    ("SA", "H"),              # len % 4 == 2
+    ("SGVsbG8=", "Hello"),    # already padded
+    ("S", ""),                # len % 4 == 1 is never valid
+    ("_w", "\ufffd"),        # invalid UTF-8 byte is replaced
+    ("", ""),
+])
+def test_decode_part_data_padding(data, expected):
+    """
+    Test base64url body data decodes with or without trailing padding.
+    """
+    assert _decode_part_data(data) == expected
+
+def test_extract_message_text_preserves_part_order():
+    """
+    Test nested parts are concatenated in the order they appear in the message.
+    """
+    def text_part(text):
+        return {"mimeType": "text/plain", "body": {"data": base64.urlsafe_b64encode(text.encode()).decode()}}
+
+    payload = {
+        "mimeType": "multipart/mixed",
+        "parts": [
+            {"mimeType": "multipart/mixed", "parts": [text_part("First"), text_part("Second")]},
+            text_part("Third"),
+        ],
+    }
+    assert extract_message_text(payload) == "First\nSecond\nThird"
+
+async def test_decode_json_bodies_yields_to_other_tasks():
+    """
+    Test response decoding gives other tasks a turn once STARVATION_LIMIT_SEC is exceeded.
+    """
+    ticks = []
+
+    async def ticker():
+        while True:
+            ticks.append(None)
+            await asyncio.sleep(0)
+
+    ticker_task = asyncio.create_task(ticker())
+    with patch.object(gmail_agent, 'STARVATION_LIMIT_SEC', 0):
+        result = await _decode_json_bodies([b'{"id": "msg1"}', b'', b'{"id": "msg2"}'])
+    ticker_task.cancel()
+
+    assert result == [{"id": "msg1"}, {}, {"id": "msg2"}]
+    assert len(ticks) >= 2